@@ -7,15 +7,24 @@
 
 # Python math library
 import math 
+
+# Efficient arrays of numeric values
+import array
  
 # ROS client library for Python
 import rclpy 
  
-# Enables pauses in the execution of code
-from time import sleep 
+# Enables pauses in the execution of code and time measurements
+from time import sleep, monotonic
  
 # Used to create nodes
 from rclpy.node import Node
+
+# Executes the callbacks of the node in a pool of threads
+from rclpy.executors import MultiThreadedExecutor
+
+# Lets the laser callbacks run in parallel with the other callbacks
+from rclpy.callback_groups import ReentrantCallbackGroup
  
 # Enables the use of the string message type
 from std_msgs.msg import String 
@@ -32,15 +41,11 @@ from geometry_msgs.msg import Pose
 # Handle float64 arrays
 from std_msgs.msg import Float64MultiArray
                      
-# Handles quality of service for LaserScan data
-from rclpy.qos import qos_profile_sensor_data 
+# Handles quality of service for LaserScan data and velocity commands
+from rclpy.qos import qos_profile_sensor_data, QoSProfile, HistoryPolicy, ReliabilityPolicy
  
 # Scientific computing library
 import numpy as np
-
-from geometry_msgs.msg import Point
-from interfaces.srv import SendPoint
-from interfaces.srv import ProcessPoint
  
 class Controller(Node):
   """
@@ -56,48 +61,63 @@ class Controller(Node):
     # Initiate the Node class's constructor and give it a name
 
     super().__init__('Controller')
+
+    # Callback group of the laser scans, so that they are not delayed by the other callbacks.
+    self.scan_cb_group = ReentrantCallbackGroup()
  
     # Create a subscriber
     # This node subscribes to messages of type 
     # sensor_msgs/LaserScan     
+    # Only the newest scan is evaluated, so the sensor data profile
+    # is used with a depth of 1 and older scans are dropped by the middleware.
     self.scan_subscriber = self.create_subscription(
                            LaserScan,
                            '/scan',
                            self.scan_callback,
-                           10)
+                           QoSProfile(depth=1,
+                                      history=qos_profile_sensor_data.history,
+                                      reliability=qos_profile_sensor_data.reliability,
+                                      durability=qos_profile_sensor_data.durability),
+                           callback_group=self.scan_cb_group)
                             
     # Create a publisher
     # This node publishes the linear and angular velocity of the robot.
+    # Only the latest command matters. The publisher stays reliable because
+    # the diff drive controller subscribes to /cmd_vel with a reliable QoS.
     self.publisher_ = self.create_publisher(
                       Twist, 
                       '/cmd_vel', 
-                      10)
+                      QoSProfile(depth=1,
+                                 reliability=ReliabilityPolicy.RELIABLE,
+                                 history=HistoryPolicy.KEEP_LAST))
 
     # Desired linear and angular velocities for centroid tracking
-    self.vel_x = 0.0
-    self.vel_z = 0.0
+    # [linear x, linear y, linear z, angular x, angular y, angular z]
+    self.twist_state = np.zeros(6, dtype=np.float32)
 
     # Initialize the LaserScan sensor readings to some large value
     # Values are in meters.
     self.max_distance = 5.0
     self.front_dist = self.max_distance
 
-    # Create a server to the centroid service, to process the client (depth_finder.py) request.
-    # composed of the centroid position and depth.
-    self.srv = self.create_service(SendPoint, 'centroid', self.receive_point_callback)
-
-    # This value will be the request value to bee processed in the des_vel server.
-    self.pid_request = ProcessPoint.Request()
+    # Boundaries of the LaserScan sectors, as beam indices.
+    # The first sector covers the front of the robot, more boundaries can be appended
+    # to get the minimum distance of more sectors in the same pass.
+    self.sector_bounds = np.array([260, 400], dtype=np.intp)
 
-    # Create a client to the des_vel service, to send the centroid position and depth to the 
-    # pid_controller node.
-    self.cli = self.create_client(ProcessPoint, 'des_vel')
-
-    # Waiting for the service to be availabe
-    while not self.cli.wait_for_service(timeout_sec=1.0):
-      self.get_logger().info('Service not available, waiting again...')
-
-    self.data_received = 0
+    # Create a subscriber
+    # This node subscribes to the velocities generated by the pid controllers
+    # of the pid_controller node for the centroid tracking.
+    self.des_vel_subscriber = self.create_subscription(
+                              Twist,
+                              'des_vel',
+                              self.des_vel_callback,
+                              10)
+
+    # Time of the last velocities received from the pid_controller node.
+    # If no velocities are received within vel_timeout seconds, the previous ones are decayed.
+    self.last_msg_time = monotonic()
+    self.vel_timeout = 0.1 # seconds
 
     ### OBSTALCE AVOIDANCE PARAMETERS ### 
  
@@ -105,84 +125,96 @@ class Controller(Node):
     # We want to try to keep within this distance from the wall.
     self.dist_thresh_wf = 1.1 # meters
 
-    # Calling the collision_avoidance() method.
-    self.collision_avoidance()
+    # Create a geometry_msgs/Twist message, reused for every velocity command.
+    self.msg = Twist()
+
+    # Publish method of the velocity commands.
+    self.publish_cmd_vel = self.publisher_.publish
+
+    # Create a watchdog timer calling the decay_if_stale() method every 0.05 seconds.
+    self.timer = self.create_timer(0.05, self.decay_if_stale)
 
 
-  def receive_point_callback(self, req, res):
+  def des_vel_callback(self, msg):
     """
-    This method receives the request message from the depth_finder node 
-    and send a true value as response every time a request is correctly received.
+    This method gets called every time the pid_controller node publishes 
+    the velocities for the target tracking.
     """
-    self.get_logger().info('Received centroid')
-    self.pid_request.centroid = req.centroid
-    self.data_received = 1
-    res.check = True
-    return res
+    self.get_logger().debug('Received pid controller velocities')
+
+    # These are the linear and angular velocities generated by the pid controllers.
+    state = self.twist_state
+    state[0] = msg.linear.x
+    state[1] = msg.linear.y
+    state[2] = msg.linear.z
+    state[3] = msg.angular.x
+    state[4] = msg.angular.y
+    state[5] = msg.angular.z
+    self.last_msg_time = monotonic()
+
+    self.collision_avoidance()
 
   def scan_callback(self, msg):
     """
     This method gets called every time a LaserScan message is 
     received and updates the frontal distance. 
     """
-    self.get_logger().info('Received laserscan')
-    self.front_dist = min(msg.ranges[260:400])
+    self.get_logger().debug('Received laserscan')
+
+    # Minimum distance of every sector in a single reduction.
+    # NaN readings (invalid beams) are ignored by fmin, inf means nothing in range.
+    # msg.ranges is normally an array.array of float32: its buffer is wrapped without copies.
+    if isinstance(msg.ranges, array.array):
+      ranges = np.frombuffer(msg.ranges, dtype=np.float32)
+    else:
+      ranges = np.asarray(msg.ranges, dtype=np.float32)
+    sector_mins = np.fmin.reduceat(ranges[:self.sector_bounds[-1]], self.sector_bounds[:-1])
+    self.front_dist = float(sector_mins[0])
    
+  def decay_if_stale(self):
+    """
+    This method is periodically called by the watchdog timer. If no new velocities 
+    are received from the pid_controller node, the previous velocities are decayed.
+    """
+    if monotonic() - self.last_msg_time > self.vel_timeout:
+      # If no velocities are received from the pid_controller node, the 80% of the previous velocities are published.
+      self.twist_state *= 0.8
+      self.collision_avoidance()
+
   def collision_avoidance(self):
     """
-    This method receives the pid generated velocities for the target tracking 
+    This method publishes the pid generated velocities for the target tracking 
     and causes the robot to stop if a frontal obstacle is detected.
     """
+    # Logic:
+    # >d means no wall detected by the laser beam
+    # <d means an wall was detected by the laser beam
+    d = self.dist_thresh_wf
 
-    # Create a geometry_msgs/Twist message
-    msg = Twist()
-
-    while rclpy.ok():
-      rclpy.spin_once(self)
-
-      if self.data_received == 1:
-
-        # Send a client request with the centroid's coordinates and depth.
-        self.future = self.cli.call_async(self.pid_request)
-
-        # Wait until a response from pid_controller node is received. 
-        rclpy.spin_until_future_complete(self, self.future)
-        self.get_logger().info('Received pid controller response')
-
-        # These are the linear and angular velocities generated by the pid controllers.
-        res = self.future.result()
-        self.vel_x = res.desired_velocities.linear.x
-        self.vel_z = res.desired_velocities.angular.z
-
-      else:
-        # If no centroid is received from the centroid service, the 80% of the previous velocities are published.
-        self.vel_x = 0.8 * self.vel_x
-        self.vel_z = 0.8 * self.vel_z
+    msg = self.msg
+    lin_x, lin_y, lin_z, ang_x, ang_y, ang_z = self.twist_state.tolist()
+    msg.linear.y = lin_y
+    msg.linear.z = lin_z
+    msg.angular.x = ang_x
+    msg.angular.y = ang_y
 
-      # Logic:
-      # >d means no wall detected by the laser beam
-      # <d means an wall was detected by the laser beam
-      d = self.dist_thresh_wf
+    # Only data front laser scan data are evaluated so as to avoid losing sight of the centroid.
 
-      # Only data front laser scan data are evaluated so as to avoid losing sight of the centroid.
+    if self.front_dist > d:     # No obstacles detected in front of the robot.
+      self.wall_following_state = "1: No obstacles detected"
+      msg.linear.x = lin_x
+      msg.angular.z = ang_z
 
-      if self.front_dist > d:     # No obstacles detected in front of the robot.
-        self.wall_following_state = "1: No obstacles detected"
-        msg.linear.x = self.vel_x
-        msg.angular.z = self.vel_z
+    else:                       # Obstacles detected in front of the robot. 
+      self.wall_following_state = "2: Obstacles detected at " + str(round(self.front_dist, 3)) + " meters in front of the robot."
+      msg.linear.x = 0.0       # stops the robot.
+      msg.angular.z = ang_z    # only anglular velocities are allowed.
 
-      else:                       # Obstacles detected in front of the robot. 
-        self.wall_following_state = "2: Obstacles detected at " + str(round(self.front_dist, 3)) + " meters in front of the robot."
-        msg.linear.x = 0.0            # stops the robot.
-        msg.angular.z = self.vel_z    # only anglular velocities are allowed.
-  
-      # Send velocity command to the robot.
-      self.publisher_.publish(msg)
+    # Send velocity command to the robot.
+    self.publish_cmd_vel(msg)
 
-      self.data_received = 0
-    
-      # Print robot state information in terminal.
-      self.get_logger().info('State: "%s"' % self.wall_following_state)
+    # Print robot state information in terminal, at most once per second.
+    self.get_logger().info('State: "%s"' % self.wall_following_state, throttle_duration_sec=1.0)
 
 def main(args=None):
  
@@ -195,7 +227,16 @@ def main(args=None):
     # Spin the node so the callback function is called
     # Pull messages from any topics this node is subscribed to
     # Publish any pending messages to the topics
-    rclpy.spin(controller)
+    # A single executor drives the timer and the subscriptions.
+    # Two threads let the laser scans be processed while a velocity command is published.
+    executor = MultiThreadedExecutor(num_threads=2)
+    executor.add_node(controller)
+
+    # Ctrl-C stops the spin, so that the node is still destroyed below.
+    try:
+      executor.spin()
+    except KeyboardInterrupt:
+      pass
 
     # Destroy the node explicitly
     # (optional - otherwise it will be done automatically
@@ -4,8 +4,7 @@ from sensor_msgs.msg import Image # Image is the message type
 from cv_bridge import CvBridge # Package to convert between ROS and OpenCV Images
 import cv2 # OpenCV library
 import numpy as np
-from geometry_msgs.msg import PointStamped
-from interfaces.srv import SendPoint
+from geometry_msgs.msg import Point, PointStamped
 
 
 class DepthFinder(Node):
@@ -41,19 +40,11 @@ class DepthFinder(Node):
     # Used to convert between ROS and OpenCV images.
     self.br = CvBridge()
 
-    # Create a client to the centroid service, to send the centroid position and depth to the 
-    # robot_controller node.
-    self.cli = self.create_client(SendPoint, 'centroid')
+    # Create the publisher. This publisher will send the centroid position and depth to the 
+    # pid_controller node.
+    self.pub_centroid = self.create_publisher(Point, 'centroid', 10)
 
-    # Wait until the service is available.
-    while not self.cli.wait_for_service(timeout_sec=1.0):
-      self.get_logger().info('service not available, waiting again...')
-
-    self.ctrl_input = SendPoint.Request()   # Service request.
-    self.client_futures = []                # Buffer to store service responses.
-
-    # Calls the spin function to output asynchronously the service responses.
-    self.spin()
+    self.ctrl_input = Point()   # Centroid message.
     
   def range_cb(self, data):
     """
@@ -89,37 +80,22 @@ class DepthFinder(Node):
             frame = cv2.resize(current_frame, (640, 480))
 
             # Centroid coordinates.
-            self.ctrl_input.centroid.x = msg.point.x
-            self.ctrl_input.centroid.y = msg.point.y
+            self.ctrl_input.x = msg.point.x
+            self.ctrl_input.y = msg.point.y
             # Centroid depth.
-            self.ctrl_input.centroid.z = float(frame[int(msg.point.y), int(msg.point.x)])
+            self.ctrl_input.z = float(frame[int(msg.point.y), int(msg.point.x)])
 
-            self.get_logger().info('Centroid Depth = ' + str(round(self.ctrl_input.centroid.z, 4)) + ' [m]')
+            self.get_logger().info('Centroid Depth = ' + str(round(self.ctrl_input.z, 4)) + ' [m]',
+                                   throttle_duration_sec=1.0)
 
-            # Send a client request with the centroid's coordinates and depth.
-            self.client_futures.append(self.cli.call_async(self.ctrl_input))
+            # Publish the centroid's coordinates and depth.
+            self.pub_centroid.publish(self.ctrl_input)
             return
 
         # If the image in the buffer is older than the message, removes it.
         if msg_nsec > image_nsec:
             self.buffer.pop(0)
 
-  def spin(self):
-    """
-    Print on screen the result of the service call.
-    """
-    while rclpy.ok():
-      rclpy.spin_once(self)
-      incomplete_futures = []                    # Initialize a buffer.
-      for f in self.client_futures:              # For every service request.
-        if f.done():                             # If the response has arrived.
-          res = f.result()                       # Gets the service response.
-          self.get_logger().info('Service SendPoint response:' + str(res.check))
-        else:
-          incomplete_futures.append(f)           # The service has not received a response yet.
-      self.client_futures = incomplete_futures   # Refresh the service requests.
-
-
 
 def main(args=None):
   
@@ -130,7 +106,11 @@ def main(args=None):
   depth_finder = DepthFinder()
   
   # Spin the node so the callback function is called.
-  rclpy.spin(depth_finder)
+  # Ctrl-C stops the spin, so that the node is still destroyed below.
+  try:
+    rclpy.spin(depth_finder)
+  except KeyboardInterrupt:
+    pass
   
   # Destroy the node explicitly
   # (optional - otherwise it will be done automatically
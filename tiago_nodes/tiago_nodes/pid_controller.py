@@ -1,13 +1,29 @@
 import rclpy # Python library for ROS 2
-from simple_pid import PID
 import time
 import numpy as np
+from numba import njit
 from rclpy.node import Node # Handles the creation of nodes
+from rclpy.parameter import Parameter
+from rcl_interfaces.msg import SetParametersResult
 from geometry_msgs.msg import Point, Twist
 from trajectory_msgs.msg import JointTrajectory
 from trajectory_msgs.msg import JointTrajectoryPoint
 
-from interfaces.srv import ProcessPoint
+
+@njit('f8[::1](f4[:, ::1], f4[::1], f4[::1], f4[:, ::1], f8)', cache=True)
+def pid_step(state, meas, setpoints, gains, dt):
+  """
+  Compute one step of a set of PID controllers, one per row.
+  Each state row [integral term, previous measurement] is updated in place, each gains row is [kp, ki, kd].
+  The integral term accumulates ki * error * dt, so changing ki doesn't rescale the past errors.
+  The derivative is taken on the measurement, so setpoint changes don't cause a derivative kick.
+  dt must not be smaller than the sample time: the sample-time gating is done by the caller.
+  """
+  error = setpoints - meas
+  state[:, 0] += gains[:, 1] * error * dt
+  derivative = (state[:, 1] - meas) / dt
+  state[:, 1] = meas
+  return gains[:, 0] * error + state[:, 0] + gains[:, 2] * derivative
 
 class Controller(Node):
 
@@ -27,17 +43,45 @@ class Controller(Node):
     # This node publishes the desired tilt head joint trajectory in order to keep tracking the centroid .
     self.cmd_vel_joint_publisher = self.create_publisher(JointTrajectory, "/command_pose_head", 1)
 
-    # Increase Hertz execution.
-    self.timer = self.create_timer(0.1, self.head_angle)
+    # Create publisher.
+    # This node publishes the desired velocities for the centroid tracking to the robot_controller node.
+    self.des_vel_publisher = self.create_publisher(Twist, 'des_vel', 10)
 
     # Implementing the two PD controllers for the centroid tracking.
+    # They are updated together: row 0 is the depth controller, row 1 the orientation one.
     # Depth PD controller.
     # The robot should keep a 2m distance from target (centroid).
-    self.pid_distance = PID(-0.2, 0, -0.4, setpoint=2)
-
     # Orientation PD controller.
     # The x centroid coordinate should be the half the the image width (i.e. pixel number 320).
-    self.pid_orientation = PID(0.0008, 0, 0.0016, setpoint=320)
+    # Gains [kp, ki, kd] and setpoints are ROS parameters, so that they can be tuned while running.
+    self.declare_parameter('distance_gains', [-0.2, 0.0, -0.4])
+    self.declare_parameter('distance_setpoint', 2.0)
+    self.declare_parameter('orientation_gains', [0.0008, 0.0, 0.0016])
+    self.declare_parameter('orientation_setpoint', 320.0)
+
+    self.pid_gains = np.array([self.get_parameter('distance_gains').value,
+                               self.get_parameter('orientation_gains').value], dtype=np.float32)
+    self.pid_setpoints = np.array([self.get_parameter('distance_setpoint').value,
+                                   self.get_parameter('orientation_setpoint').value], dtype=np.float32)
+    self.add_on_set_parameters_callback(self.parameters_cb)
+
+    # [integral term, previous measurement] of each controller.
+    self.pid_state = np.zeros((2, 2), dtype=np.float32)
+
+    # Measurements of the controllers: centroid depth and x coordinate.
+    self.pid_meas = np.zeros(2, dtype=np.float32)
+
+    # pid_step is compiled for its explicit signature when the module is imported, or loaded
+    # from the on-disk cache. A dummy call makes sure it is ready before the first centroid.
+    pid_step(np.zeros((2, 2), dtype=np.float32), np.zeros(2, dtype=np.float32),
+             np.zeros(2, dtype=np.float32), np.zeros((2, 3), dtype=np.float32), 0.01)
+
+    # Time of the last controllers update, None until the first centroid is received.
+    self.last_time = None
+
+    # Minimum time between two controllers updates, in seconds.
+    # Centroids received sooner than this reuse the previous velocities.
+    self.sample_time = 0.01
 
     # Message for publishing the desired command velocity.
     self.msg = Twist()
@@ -52,44 +96,117 @@ class Controller(Node):
     self.traj_points.velocities = [0.1]
     self.traj_points.positions = [0.1]
 
-    # Create a server of the des_vel service, to process the client (robot_controller.py) request
-    # composed of the centroid position and depth.
-    self.srv = self.create_service(ProcessPoint, 'des_vel', self.control_cb)
+    # The trajectory point is reused: head_angle() only updates its position in place.
+    self.msg_joint.points = [self.traj_points]
+
+    # Last published head position, the trajectory is published again only when it changes.
+    self.last_head_pos = None
+
+    # The head trajectory is also re-published once per second, in case a publish is lost
+    # (e.g. before the head controller is connected).
+    self.head_timer = self.create_timer(1.0, self.republish_head)
+
+    # Create the subscriber. This subscriber will receive the centroid position and depth
+    # from the depth_finder node.
+    self.sub_centroid = self.create_subscription(Point, 'centroid', self.control_cb, 10)
 
     
-  def control_cb(self, req, res):
+  def control_cb(self, msg):
     """
     Callback function.
     """
+    # Both the velocities and the head trajectory (if changed) are published at the end of this callback.
+    pub_v = self.des_vel_publisher.publish
+    pub_j = self.cmd_vel_joint_publisher.publish
+
+    # Attributes used on every centroid, bound to locals.
+    vel = self.msg
+    meas = self.pid_meas
+
     # Reading the centroid coordinates and depth.
-    self.x = req.centroid.x
-    self.y = req.centroid.y
-    self.depth = req.centroid.z
+    x = self.x = msg.x
+    self.y = msg.y
+    depth = self.depth = msg.z
+
+    meas[0] = depth
+    meas[1] = x
 
-    # Sending the target tracking required velocities to the client node (robot_controller.py).  
-    res.desired_velocities.linear.x = float(self.pid_distance(self.depth))
-    res.desired_velocities.angular.z = float(self.pid_orientation(self.x))
-    return res
+    now = time.monotonic()
+    if self.last_time is None:
+      # First centroid: seed the previous measurements so that no derivative kick is produced.
+      self.pid_state[:, 1] = meas
+      dt = self.sample_time
+    else:
+      dt = now - self.last_time
+
+    # Centroids processed back to back would divide the derivative by a tiny dt:
+    # the controllers are only updated once per sample time, as simple_pid did.
+    if dt >= self.sample_time:
+      self.last_time = now
+
+      # Sending the target tracking required velocities to the robot_controller node.  
+      out = pid_step(self.pid_state, meas, self.pid_setpoints, self.pid_gains, dt)
+      vel.linear.x = float(out[0])
+      vel.angular.z = float(out[1])
+
+    # Updating the head joint trajectory for the new centroid.
+    self.head_angle()
+
+    pub_v(vel)
+
+    head_pos = self.traj_points.positions[0]
+    if self.last_head_pos is None or abs(head_pos - self.last_head_pos) > 1e-3:
+      pub_j(self.msg_joint)
+      self.last_head_pos = head_pos
+
+    self.get_logger().info('Control Errors [' + str(x - 320) +  ' [px], ' + str(round(depth - 2, 4)) + ' [m] ]',
+                           throttle_duration_sec=1.0)
+
+  def parameters_cb(self, params):
+    """
+    Callback function, updates the gains and setpoints of the PID controllers.
+    """
+    # Row of each controller in the gains and setpoints arrays.
+    rows = {'distance': 0, 'orientation': 1}
+
+    # Checking all the parameters first, so that they are applied all or none.
+    for param in params:
+      if param.name.endswith('_gains') and (param.type_ != Parameter.Type.DOUBLE_ARRAY or len(param.value) != 3):
+        return SetParametersResult(successful=False, reason=param.name + ' must be a list of 3 floats [kp, ki, kd]')
+      if param.name.endswith('_setpoint') and param.type_ != Parameter.Type.DOUBLE:
+        return SetParametersResult(successful=False, reason=param.name + ' must be a float')
+
+    for param in params:
+      controller, _, field = param.name.rpartition('_')
+      if controller in rows and field == 'gains':
+        self.pid_gains[rows[controller]] = param.value
+      elif controller in rows and field == 'setpoint':
+        self.pid_setpoints[rows[controller]] = param.value
+
+    return SetParametersResult(successful=True)
+
+  def republish_head(self):
+    """
+    This method periodically re-publishes the current head joint trajectory.
+    """
+    self.cmd_vel_joint_publisher.publish(self.msg_joint)
+    self.last_head_pos = self.traj_points.positions[0]
 
   def head_angle(self):
     """
-    This method makes some simple joint head movement.  
+    This method makes some simple joint head movement, by updating the 
+    head joint trajectory point according to the centroid position and depth.
     """
 
     # The y coordinates is on top of the image and TIAGo is pretty close to the target
     if self.y <= 160 and self.depth < 3.2 and self.depth > 0.5:
 
-      self.traj_points.positions = [0.3]  # Raises TIAGo's head
+      self.traj_points.positions[0] = 0.3  # Raises TIAGo's head
 
     # The y coordinates is in the middle the image and TIAGo is pretty far from the target
     elif self.y > 180 and self.y <= 340 and self.depth > 3.4:
 
-      self.traj_points.positions = [0.1]  # Alligns TIAGo's head
-
-    self.msg_joint.points = [self.traj_points]
-    self.cmd_vel_joint_publisher.publish(self.msg_joint)
-
-    self.get_logger().info('Control Errors [' + str(self.x - 320) +  ' [px], ' + str(round(self.depth - 2, 4)) + ' [m] ]')
+      self.traj_points.positions[0] = 0.1  # Alligns TIAGo's head
 
 def main(args=None):
   
@@ -100,7 +217,11 @@ def main(args=None):
   controller = Controller()
   
   # Spin the node so the callback function is called.
-  rclpy.spin(controller)
+  # Ctrl-C stops the spin, so that the node is still destroyed below.
+  try:
+    rclpy.spin(controller)
+  except KeyboardInterrupt:
+    pass
   
   # Destroy the node explicitly
   # (optional - otherwise it will be done automatically